@@ -15,8 +15,6 @@ from app.services.dashboard_service import(
 from app.views.restock_manager import build_kpis
 from app.views.charts.stock_status_dashboard_chart import show_out_of_stock_pie
 
-STATUS_ORDER = ["Critical", "Reorder now", "Near", "Healthy"]
-
 def overall_restock_status_from_kpis(kpis: dict) -> dict:
     def g(key):  
         v = kpis.get(key, 0)
@@ -107,7 +105,6 @@ def show_dashboard():
 
     data = fetch_restock_kpi_source()
     df, kpis = build_kpis(data)
-    df["status"] = pd.Categorical(df["status"], categories=STATUS_ORDER, ordered=True)
 
     status = overall_restock_status_from_kpis(kpis)  # tu helper
     stock_status = get_items_out_of_stock_status()
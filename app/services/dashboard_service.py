@@ -1,8 +1,9 @@
-import os, requests
+import os
 import streamlit as st
 from dotenv import load_dotenv
 from datetime import datetime
 from urllib.parse import quote
+from app.services.supabase_uploader import SESSION
 
 load_dotenv()
 
@@ -16,7 +17,7 @@ HEADERS = {
 
 def fetch_stockout_items():
     url = f"{SUPABASE_URL}/rest/v1/Stockout_Items?select=item_id,description,on_hand,category_id"
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.ok:
         return response.json()
     else:
@@ -26,7 +27,7 @@ def fetch_stockout_items():
 
 def fetch_categories():
     url = f"{SUPABASE_URL}/rest/v1/Item_Categories?select=id,name"
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.ok:
         return response.json()
     else:
@@ -39,7 +40,7 @@ def fetch_last_system_stock_date() -> str | None:
         "&order=updated_at.desc.nullslast"
         "&limit=1"
     )
-    r = requests.get(url, headers=HEADERS, timeout=15)
+    r = SESSION.get(url, headers=HEADERS, timeout=15)
     if not r.ok:
         st.error(f"Supabase {r.status_code}: {r.text}")
         return None
@@ -53,7 +54,7 @@ def fetch_last_physical_stock_info() -> str | None:
         "&order=created_at.desc.nullslast"
         "&limit=1"
     )
-    r = requests.get(url, headers=HEADERS, timeout=15)
+    r = SESSION.get(url, headers=HEADERS, timeout=15)
     if not r.ok:
         st.error(f"Supabase {r.status_code}: {r.text}")
         return None
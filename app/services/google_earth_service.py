@@ -1,11 +1,13 @@
 # app/services/supabase_io.py
 from __future__ import annotations
+from functools import lru_cache
 from typing import Optional
 from supabase import create_client
 
 # ----- Client -----
+@lru_cache(maxsize=4)
 def make_supabase(url: str, key: str):
-    """Return a configured Supabase client."""
+    """Return a configured Supabase client (one per url/key, reused across reruns)."""
     return create_client(url, key)
 
 # ----- Storage (bucket) -----
@@ -1,5 +1,7 @@
 import os, requests, uuid
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import urllib.parse
 from dotenv import load_dotenv
 from datetime import datetime
@@ -15,27 +17,25 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
-# Get user name 
-def get_user_name_by_email(email: str) -> str | None:
-    url = f"{SUPABASE_URL}/rest/v1/Users?email=eq.{email}&select=name"
-    response = requests.get(url, headers=HEADERS)
+# One pooled session per process so consecutive REST calls reuse the same TLS connection
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
+SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
 
-    if response.ok:
-        data = response.json()
-        if data and "name" in data[0]:
-            return data[0]["name"]
-    return None
+def chunked(seq: list, size: int = 1000):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
 
-# Get user id
-def get_user_id_by_email(email: str) -> str | None:
-    url = f"{SUPABASE_URL}/rest/v1/Users?email=eq.{email}&select=id"
-    response = requests.get(url, headers=HEADERS)
+# Get user id and name in one request
+def get_user_by_email(email: str) -> dict:
+    url = f"{SUPABASE_URL}/rest/v1/Users?email=eq.{email}&select=id,name&limit=1"
+    response = SESSION.get(url, headers=HEADERS)
 
     if response.ok:
         data = response.json()
-        if data and "id" in data[0]:
-            return data[0]["id"]
-    return None
+        if data:
+            return {"id": data[0].get("id"), "name": data[0].get("name")}
+    return {"id": None, "name": None}
 
 def get_or_create_category(category_name):
     name = str(category_name).strip() if category_name else ""
@@ -43,14 +43,14 @@ def get_or_create_category(category_name):
     if name.lower() in ["", "nan", "none"]:
         name = "No Category"
 
-    response = requests.get(
+    response = SESSION.get(
         f"{SUPABASE_URL}/rest/v1/Item_Categories?name=eq.{name}",
         headers=HEADERS
     )
     if response.ok and response.json():
         return response.json()[0]["id"]
 
-    response = requests.post(
+    response = SESSION.post(
         f"{SUPABASE_URL}/rest/v1/Item_Categories",
         headers=HEADERS,
         json={"name": name}
@@ -67,31 +67,36 @@ def get_or_create_category(category_name):
         return None
 
 def fetch_all_categories():
-    url = f"{SUPABASE_URL}/rest/v1/Item_Categories?select=id,name&order=name.asc"
-    r = requests.get(url, headers=HEADERS)
+    url = f"{SUPABASE_URL}/rest/v1/Item_Categories?select=name&order=name.asc"
+    r = SESSION.get(url, headers=HEADERS)
     return r.json() if r.ok else []
 
-def get_latest_stock_items(categories: list[str] | None = None):
-    base = f"{SUPABASE_URL}/rest/v1/Latest_Item_Stock?select=name,description,category_name"
+def get_latest_stock_items(categories: list[str] | None = None,
+                           columns: tuple = ("name", "description", "category_name"),
+                           raise_on_error: bool = False):
+    base = f"{SUPABASE_URL}/rest/v1/Latest_Item_Stock?select={','.join(columns)}"
 
     if categories:
-        vals = ",".join([f"%22{c}%22" for c in categories if c and str(c).strip()])
+        # Quoted and URL-encoded so names with '&', ',' or '#' stay inside the filter
+        vals = ",".join([quote(_postgrest_quote(str(c)), safe="") for c in categories if c and str(c).strip()])
         url = f"{base}&category_name=in.({vals})"
     else:
         url = base
 
-    r = requests.get(url, headers=HEADERS, timeout=30)
+    r = SESSION.get(url, headers=HEADERS, timeout=30)
     if r.ok:
         return r.json()
     else:
         print(f"❌ Error fetching latest stock items: {r.status_code} - {r.text}")
+        if raise_on_error:
+            raise RuntimeError(f"Supabase error {r.status_code}")
         return []
 
 def get_item_by_name(name):
     encoded_name = urllib.parse.quote(name)
     url = f"{SUPABASE_URL}/rest/v1/Items?name=ilike.{encoded_name}"
 
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
 
     try:
         if response.ok:
@@ -107,9 +112,46 @@ def get_item_by_name(name):
 
     return None
 
+def _postgrest_quote(value: str) -> str:
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _fetch_items_chunk(chunk: list) -> list:
+    filters = ",".join(f"name.ilike.{_postgrest_quote(n)}" for n in chunk)
+    response = SESSION.get(
+        f"{SUPABASE_URL}/rest/v1/Items",
+        headers=HEADERS,
+        params={"select": "id,name", "or": f"({filters})"},
+        timeout=30,
+    )
+    try:
+        if response.ok:
+            return response.json()
+        print(f"❌ Error querying items by name: {response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"❌ Exception parsing items response: {e}")
+    return []
+
+def get_items_by_names(names: list, chunk_size: int = 100) -> dict:
+    # Same case-insensitive match as get_item_by_name, batched into or=(...) filters
+    unique = list(dict.fromkeys(str(n) for n in names if n is not None and str(n).strip()))
+    chunks = list(chunked(unique, chunk_size))
+    if not chunks:
+        return {}
+
+    # Chunks are independent; fetch them concurrently over the pooled session
+    with ThreadPoolExecutor(max_workers=min(4, len(chunks))) as pool:
+        results = list(pool.map(_fetch_items_chunk, chunks))
+
+    found = {}
+    for rows in results:
+        for row in rows:
+            found.setdefault(str(row.get("name", "")).lower(), row)
+
+    return {n: found[n.lower()] for n in unique if n.lower() in found}
+
 def insert_item(item_data):
     try:
-        response = requests.post(
+        response = SESSION.post(
             f"{SUPABASE_URL}/rest/v1/Items",
             headers=HEADERS,
             json=item_data
@@ -133,7 +175,7 @@ def insert_item(item_data):
         return None
 
 def insert_stock(stock_data):
-    response = requests.post(
+    response = SESSION.post(
         f"{SUPABASE_URL}/rest/v1/System_Stock",
         headers=HEADERS,
         json=stock_data
@@ -144,7 +186,16 @@ def insert_stock(stock_data):
         print(f"🔴 Supabase response: {response.status_code} - {response.text}")
 
 def upload_inventory_data(items_data: list):
-    total = len(items_data)
+    # One item lookup and one System_Stock insert per call; categories are resolved once per name
+    # Keyed by lowercased name: the lookup is case-insensitive (ilike), so 'Widget' and
+    # 'WIDGET' in the same upload must resolve to one item
+    existing_items = {
+        n.lower(): item
+        for n, item in get_items_by_names([str(r.get("Name", "")).strip() for r in items_data]).items()
+    }
+    category_ids = {}
+    stock_rows = []
+    stock_names = []
 
     for idx, row in enumerate(items_data):
         name = str(row.get("Name", "")).strip()
@@ -155,18 +206,22 @@ def upload_inventory_data(items_data: list):
             st.warning(f"⚠️ Empty name in row {idx+1}. Skipping.")
             continue
 
-        category_id = get_or_create_category(category)
+        if category not in category_ids:
+            category_ids[category] = get_or_create_category(category)
+        category_id = category_ids[category]
         if not category_id:
             st.warning(f"⚠️ Could not get/create category for '{category}'")
             continue
 
-        existing = get_item_by_name(name)
+        existing = existing_items.get(name.lower())
         if not existing:
             item = insert_item({
                 "name": name,
                 "category_id": category_id,
                 "description": description
             })
+            if item:
+                existing_items[name.lower()] = item
         else:
             item = existing
 
@@ -177,26 +232,37 @@ def upload_inventory_data(items_data: list):
             st.warning(f"⚠️ Invalid ID for '{name}': {item_id}")
             continue
 
-        stock_payload = {
+        stock_rows.append({
             "item_id": item_id,
             "on_hand": row.get("On Hand", 0),
             "available": row.get("Available", 0),
             "on_so": row.get("On SO", 0),
             "on_po": row.get("On PO", 0)
-        }
+        })
+        stock_names.append(name)
 
-        response = requests.post(
+    if stock_rows:
+        response = SESSION.post(
             f"{SUPABASE_URL}/rest/v1/System_Stock",
             headers=HEADERS,
-            json=stock_payload
+            json=stock_rows
         )
 
-        if not response.ok:
-            st.warning(f"❌ Error inserting stock for '{name}'")
-            print(f"📦 Payload: {stock_payload}")
-            print(f"🔴 Supabase response: {response.status_code} - {response.text}")
+        if response.ok:
+            print(f"✅ Stock inserted for {len(stock_rows)} items")
         else:
-            print(f"✅ Stock inserted for {name}")
+            # A bulk insert is all-or-nothing; retry row by row so only the bad rows are lost
+            print(f"🔴 Bulk stock insert failed: {response.status_code} - {response.text}")
+            for name, stock_payload in zip(stock_names, stock_rows):
+                response = SESSION.post(
+                    f"{SUPABASE_URL}/rest/v1/System_Stock",
+                    headers=HEADERS,
+                    json=stock_payload
+                )
+                if not response.ok:
+                    st.warning(f"❌ Error inserting stock for '{name}'")
+                    print(f"📦 Payload: {stock_payload}")
+                    print(f"🔴 Supabase response: {response.status_code} - {response.text}")
 
     st.success("✅ Inventory loaded successfully.")
 
@@ -210,7 +276,7 @@ def create_stock_count_entry(date, responsable, categories: list = None):
         "responsable": responsable,
         "categories": categories or []
     }
-    response = requests.post(
+    response = SESSION.post(
         f"{SUPABASE_URL}/rest/v1/Stock_Counts",
         headers=HEADERS,
         json=payload
@@ -227,7 +293,7 @@ def insert_stock_count_item(stock_count_id, item_id, quantity):
         "item_id": item_id,
         "counted_quantity": quantity
     }
-    response = requests.post(
+    response = SESSION.post(
         f"{SUPABASE_URL}/rest/v1/Stock_Count_Items",
         headers=HEADERS,
         json=payload
@@ -268,7 +334,7 @@ def insert_physical_count(data: dict):
     print("📨 Sending stock count:")
     print("Payload:", data)
 
-    response = requests.post(url, headers=custom_headers, json=data)
+    response = SESSION.post(url, headers=custom_headers, json=data)
 
     try:
         result = response.json()
@@ -286,7 +352,7 @@ def insert_physical_count(data: dict):
         print(f"Response text: {response.text}")
         return None
    
-def insert_physical_count_items(items: list) -> bool:
+def insert_physical_count_items(items: list, batch_size: int = 1000) -> bool:
     
     url = f"{SUPABASE_URL}/rest/v1/Stock_Count_Items"
 
@@ -295,17 +361,29 @@ def insert_physical_count_items(items: list) -> bool:
     if "return=" not in prefer:
         headers["Prefer"] = (prefer + ",return=representation").strip(",")
     headers["Content-Type"] = "application/json"
-    resp = requests.post(url, headers=headers, json=items)
-
-    if resp.ok:
-        return True
-
-    st.error("❌ Error inserting physical count items.")
-    return False
+    total_batches = -(-len(items) // batch_size)
+    inserted = 0
+    for n, batch in enumerate(chunked(items, batch_size), 1):
+        resp = SESSION.post(url, headers=headers, json=batch)
+        if not resp.ok:
+            print(f"🔴 Batch {n}/{total_batches} failed: {resp.status_code} - {resp.text}")
+            if inserted:
+                # Keep the old all-or-nothing result: drop the batches already stored
+                count_ids = ",".join(sorted({str(i["stock_count_id"]) for i in items}))
+                undo = SESSION.delete(f"{url}?stock_count_id=in.({count_ids})", headers=HEADERS)
+                if not undo.ok:
+                    st.error(f"❌ Error inserting physical count items: batch {n} of {total_batches} failed "
+                             f"and {inserted} of {len(items)} rows could not be rolled back.")
+                    return False
+            st.error(f"❌ Error inserting physical count items (batch {n} of {total_batches} failed).")
+            return False
+        inserted += len(batch)
+
+    return True
 
 def fetch_latest_stock_items():
     url = f"{SUPABASE_URL}/rest/v1/Latest_Item_Stock?select=name,description,category_name"
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.ok:
         return response.json()
     else:
@@ -314,7 +392,7 @@ def fetch_latest_stock_items():
 
 def insert_physical_count_categories(data: list):
     url = f"{SUPABASE_URL}/rest/v1/Stock_Count_Item_Categories"
-    response = requests.post(url, headers=HEADERS, json=data)
+    response = SESSION.post(url, headers=HEADERS, json=data)
 
     if response.ok:
         return True
@@ -326,7 +404,7 @@ def insert_physical_count_categories(data: list):
 
 def get_all_categories():
     url = f"{SUPABASE_URL}/rest/v1/Item_Categories?select=id,name"
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.ok:
         return response.json()
     else:
@@ -337,7 +415,7 @@ def get_all_categories():
 
 def fetch_inventory_comparison():
     url = f"{SUPABASE_URL}/rest/v1/Inventory_Comparison?select=*"
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.ok:
         return response.json()
     else:
@@ -348,7 +426,7 @@ def fetch_inventory_comparison():
 
 def fetch_orders_exceed_inventory():
     url = f"{SUPABASE_URL}/rest/v1/Orders_Exceed_Inventory?select=item_id,description,on_hand, on_so,category_id"
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.ok:
         return response.json()
     else:
@@ -365,13 +443,13 @@ def fetch_orders_exceed_inventory():
 def fetch_restock_kpi_source():
     url = f"{SUPABASE_URL}/rest/v1/restock_kpi_source"
 
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     return response.json() if response.ok else []
 
 
 def insert_restock_qt(data: list):
     url = f"{SUPABASE_URL}/rest/v1/Restock"
-    response = requests.post(url, headers=HEADERS, json=data)
+    response = SESSION.post(url, headers=HEADERS, json=data)
 
     if response.ok:
         return True
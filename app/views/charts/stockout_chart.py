@@ -1,7 +1,7 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-import requests
+from app.services.supabase_uploader import SESSION
 import os
 from dotenv import load_dotenv
 
@@ -17,7 +17,7 @@ HEADERS = {
 
 def fetch_stockout_items():
     url = f"{SUPABASE_URL}/rest/v1/Stockout_Items?select=item_id,description,on_hand,category_id"
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.ok:
         return response.json()
     else:
@@ -27,7 +27,7 @@ def fetch_stockout_items():
 
 def fetch_categories():
     url = f"{SUPABASE_URL}/rest/v1/Item_Categories?select=id,name"
-    response = requests.get(url, headers=HEADERS)
+    response = SESSION.get(url, headers=HEADERS)
     if response.ok:
         return response.json()
     else:
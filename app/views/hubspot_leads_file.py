@@ -6,9 +6,11 @@ import logging
 import traceback
 import warnings
 import gc
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import requests
 from requests.adapters import HTTPAdapter
@@ -16,6 +18,18 @@ from urllib3.util.retry import Retry
 import streamlit as st
 from dotenv import load_dotenv
 
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+try:
+    import orjson
+    json_dumps, json_loads = orjson.dumps, orjson.loads
+except ImportError:
+    json_dumps, json_loads = json.dumps, json.loads
+
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(
@@ -72,6 +86,9 @@ def create_session_with_retries():
     
     return session
 
+# Shared across reruns so Supabase calls reuse pooled connections
+HTTP_SESSION = create_session_with_retries()
+
 def safe_dataframe_operation(func, *args, **kwargs):
 
     slog(f"Starting dataframe operation: {func.__name__}")
@@ -139,46 +156,38 @@ def _fmt_mmddyyyy(val) -> str:
         pass
     return dt.strftime("%m/%d/%Y")
 
-def _normalize_yes_no_ge(val: str) -> str:
-    s = "" if val is None else str(val).strip().lower()
-    if s in {"yes", "y", "true", "1"}:
-        return "Yes"
-    if s in {"no", "n", "false", "0"}:
-        return "No"
-    if s in {"", "nan", "none", "null"}:
-        return ""
-    return ""
+YES_NO_GE = {
+    "yes": "Yes", "y": "Yes", "true": "Yes", "1": "Yes",
+    "no": "No", "n": "No", "false": "No", "0": "No",
+}
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
 
-def _parse_to_mmddyyyy_ge(val) -> str:
-    if val is None:
-        return ""
-    if isinstance(val, (datetime, pd.Timestamp)):
-        try:
-            dt = pd.to_datetime(val).to_pydatetime().replace(tzinfo=None)
-            return dt.strftime("%m/%d/%Y")
-        except Exception:
-            return ""
-    s = str(val).strip()
-    if s == "" or s.lower() in {"nan", "null", "none", "nat", "-"}:
-        return ""
-    try:
-        return datetime.strptime(s, "%m/%d/%Y").strftime("%m/%d/%Y")
-    except Exception:
-        pass
+def _normalize_yes_no_ge(s: pd.Series) -> pd.Series:
+    return s.astype(str).str.strip().str.lower().map(YES_NO_GE).fillna("")
+
+def _parse_to_mmddyyyy_ge(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s.dt.strftime("%m/%d/%Y").fillna("")
+
+    raw = s.astype(object)
     try:
-        return datetime.strptime(s, "%Y-%m-%d").strftime("%m/%d/%Y")
-    except Exception:
+        text = raw.str.strip()
+        raw = text.where(text.notna(), raw)
+    except AttributeError:  # no text cells in the column
         pass
-    try:
-        f = float(s)
-        days = int(f)
-        if 1 <= days <= 60000:
-            origin = datetime(1899, 12, 30)
-            d = origin + pd.Timedelta(days=days)
-            return d.strftime("%m/%d/%Y")
-        return ""
-    except Exception:
-        return ""
+
+    dt = pd.to_datetime(raw, format="%m/%d/%Y", errors="coerce")
+    todo = dt.isna()
+    if todo.any():
+        dt = dt.fillna(pd.to_datetime(raw[todo], format="%Y-%m-%d", errors="coerce"))
+
+    # Excel serial dates (days since 1899-12-30)
+    days = pd.to_numeric(raw.astype(str), errors="coerce").apply(np.trunc)
+    serial = dt.isna() & days.between(1, 60000)
+    if serial.any():
+        dt[serial] = EXCEL_EPOCH + pd.to_timedelta(days[serial], unit="D")
+
+    return dt.dt.strftime("%m/%d/%Y").fillna("")
 
 DATETIME_COLS = [
     "LastActionAt", "LastEmailedAt", "ClosingDate", "ClosedLostAt", "CancelledAt",
@@ -231,12 +240,14 @@ COLUMN_ALIASES = {
     "Asked contact next year date": "Asked Contact Next Year Date",
 }
 
+# The cleaning helpers below mutate the frame they receive; the Process button
+# hands the pipeline a single working copy of the main file.
+
 def normalize_column_names(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    rename_map = {old: new for old, new in COLUMN_ALIASES.items() if old in out.columns}
+    rename_map = {old: new for old, new in COLUMN_ALIASES.items() if old in df.columns}
     if rename_map:
-        out = out.rename(columns=rename_map)
-    return out
+        df.rename(columns=rename_map, inplace=True)
+    return df
 
 def load_file(uploaded_file) -> Tuple[pd.DataFrame, Optional[str]]:
 
@@ -254,7 +265,7 @@ def load_file(uploaded_file) -> Tuple[pd.DataFrame, Optional[str]]:
     elif name.endswith((".xlsx", ".xls")):
         with warnings.catch_warnings():
             warnings.simplefilter("ignore", UserWarning)
-            df = pd.read_excel(file_stream, engine="openpyxl", dtype=str)
+            df = pd.read_excel(file_stream, engine=EXCEL_ENGINE, dtype=str)
         return df, None
 
     else:
@@ -282,18 +293,7 @@ def load_file_optimized(uploaded_file, max_size_mb=5) -> Tuple[pd.DataFrame, Opt
 
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore", UserWarning)
-                
-                file_stream.seek(0) 
-                sample_df = pd.read_excel(file_stream, engine="openpyxl", nrows=5)
-                columns = sample_df.columns.tolist()
-                
-                file_stream.seek(0)
-                df = pd.read_excel(
-                    file_stream, 
-                    engine="openpyxl", 
-                    dtype=str,
-                    usecols=columns
-                )
+                df = pd.read_excel(file_stream, engine=EXCEL_ENGINE, dtype=str)
             return df, None
 
         else:
@@ -332,7 +332,7 @@ def load_previous_file_safe(prev_file, max_size_mb=5) -> Optional[pd.DataFrame]:
             try:
                 pdf = pd.read_excel(
                     file_stream,
-                    engine="openpyxl",
+                    engine=EXCEL_ENGINE,
                     dtype=str,
                     usecols=_usecols
                 )
@@ -344,7 +344,7 @@ def load_previous_file_safe(prev_file, max_size_mb=5) -> Optional[pd.DataFrame]:
                 file_stream.seek(0)  # Reiniciar el stream
                 pdf_full = pd.read_excel(
                     file_stream, 
-                    engine="openpyxl", 
+                    engine=EXCEL_ENGINE, 
                     dtype=str
                 )
                 slog(f"Previous file loaded full: {pdf_full.shape}")
@@ -367,7 +367,7 @@ def ensure_datetime_series(s: pd.Series) -> pd.Series:
     return dt
 
 def clean_majority_date_like_columns(df: pd.DataFrame, threshold: float = 0.6) -> Tuple[pd.DataFrame, int]:
-    out = df.copy()
+    out = df
     total_blanked = 0
     for col in out.columns:
         s = out[col]
@@ -381,7 +381,7 @@ def clean_majority_date_like_columns(df: pd.DataFrame, threshold: float = 0.6) -
     return out, total_blanked
 
 def format_datetime_columns(df: pd.DataFrame, cols: List[str], fmt: str) -> Tuple[pd.DataFrame, Dict[str, int]]:
-    out = df.copy()
+    out = df
     counts: Dict[str, int] = {}
     for col in cols:
         if col not in out.columns:
@@ -391,23 +391,15 @@ def format_datetime_columns(df: pd.DataFrame, cols: List[str], fmt: str) -> Tupl
         out[col] = dt.dt.strftime(fmt).fillna("")
     return out, counts
 
-def format_phone(raw: str) -> Tuple[str, str]:
-    if pd.isna(raw):
-        return "", "blank"
-    digits = ''.join(ch for ch in str(raw) if ch.isdigit())
-    if len(digits) == 0:
-        return "", "blank"
-    if len(digits) == 11 and digits.startswith('1'):
-        digits = digits[1:]
-    if len(digits) == 10:
-        area, exch, last4 = digits[:3], digits[3:6], digits[6:]
-        return f"({area}) {exch}-{last4}", "std10"
-    if len(digits) > 10:
-        area = digits[:-7]
-        exch = digits[-7:-4]
-        last4 = digits[-4:]
-        return f"({area}) {exch}-{last4}", "long"
-    return "", "short"
+# str.translate table that drops every non-digit character (memoized per code point)
+class _DigitsOnly(dict):
+
+    def __missing__(self, code: int):
+        keep = code if chr(code).isdigit() else None
+        self[code] = keep
+        return keep
+
+DIGITS_ONLY = _DigitsOnly()
 
 def format_phone_columns(df: pd.DataFrame, cols: List[str]) -> Tuple[pd.DataFrame, Dict[str, Dict[str, int]]]:
     out = df.copy()
@@ -415,44 +407,50 @@ def format_phone_columns(df: pd.DataFrame, cols: List[str]) -> Tuple[pd.DataFram
     for col in cols:
         if col not in out.columns:
             continue
-        stats = {"std10": 0, "long": 0, "short": 0, "blank": 0}
-        def _apply(v):
-            formatted, status = format_phone(v)
-            stats[status] += 1
-            return formatted
-        out[col] = out[col].apply(_apply)
-        summary[col] = stats
+        raw = out[col]
+        digits = raw.where(raw.notna(), "").astype(str).str.translate(DIGITS_ONLY)
+        # Drop the US trunk prefix from 11-digit numbers
+        trunk = (digits.str.len() == 11) & digits.str.startswith("1")
+        digits = digits.where(~trunk, digits.str[1:])
+        n = digits.str.len()
+
+        # 10 digits -> (AAA) EEE-LLLL ; longer numbers keep the extra digits in the area part
+        formatted = "(" + digits.str[:-7] + ") " + digits.str[-7:-4] + "-" + digits.str[-4:]
+        out[col] = formatted.where(n >= 10, "")
+        summary[col] = {
+            "std10": int((n == 10).sum()),
+            "long": int((n > 10).sum()),
+            "short": int(((n > 0) & (n < 10)).sum()),
+            "blank": int((n == 0).sum()),
+        }
     return out, summary
 
 def format_zipcode_column(df: pd.DataFrame, col_name: str = "ZipCode") -> pd.DataFrame:
-    out = df.copy()
+    out = df
     if col_name not in out.columns:
         return out
-    def _fmt(v):
-        s = "" if pd.isna(v) else str(v)
-        digits = "".join(ch for ch in s if ch.isdigit())
-        if len(digits) == 0:
-            return ""
-        if len(digits) >= 5:
-            return digits[:5]
-        return digits.zfill(5)
-    out[col_name] = out[col_name].apply(_fmt)
+    col = out[col_name]
+    digits = col.where(col.notna(), "").astype(str).str.translate(DIGITS_ONLY)
+    out[col_name] = digits.str[:5].str.zfill(5).where(digits.ne(""), "")
     return out
 
+def _blank_mask(s: pd.Series, nan_is_blank: bool = False) -> pd.Series:
+    text = s.astype(str)
+    mask = text.str.strip().eq("")
+    if nan_is_blank:
+        mask |= text.str.lower().eq("nan")
+    return mask
+
 def insert_columns(df: pd.DataFrame, before: Optional[str], after: Optional[str], cols_with_defaults: Dict[str, str]) -> pd.DataFrame:
-    out = df.copy()
+    out = df
 
     def _insert_at(df_, idx_, col_name, default_val):
         if col_name in df_.columns:
             df_[col_name] = df_[col_name].fillna("")
-            mask_blank = df_[col_name].astype(str).str.strip().eq("")
             if default_val != "":
-                df_.loc[mask_blank, col_name] = default_val
+                df_.loc[_blank_mask(df_[col_name]), col_name] = default_val
             return df_
-        cols = list(df_.columns)
-        cols[idx_:idx_] = [col_name]
-        df_ = df_.reindex(columns=cols)
-        df_[col_name] = default_val
+        df_.insert(idx_, col_name, default_val)
         return df_
 
     if before and before in out.columns:
@@ -472,10 +470,9 @@ def insert_columns(df: pd.DataFrame, before: Optional[str], after: Optional[str]
             if name not in out.columns:
                 out[name] = cols_with_defaults.get(name, "")
             else:
-                mask_blank = out[name].astype(str).str.strip().eq("")
                 dflt = cols_with_defaults.get(name, "")
                 if dflt != "":
-                    out.loc[mask_blank, name] = dflt
+                    out.loc[_blank_mask(out[name]), name] = dflt
     return out
 
 def enrich_from_previous_for_columns(current: pd.DataFrame, previous: Optional[pd.DataFrame], cols_to_enrich: List[str]) -> Tuple[pd.DataFrame, Dict[str, int]]:
@@ -484,76 +481,96 @@ def enrich_from_previous_for_columns(current: pd.DataFrame, previous: Optional[p
     present_cols = [c for c in cols_to_enrich if c in previous.columns]
     if not present_cols:
         return current, {"duplicated_ids": 0, "rows_enriched": 0}
-    previous = previous.drop_duplicates(subset=["Id"], keep="first")
-    merged = current.merge(previous[["Id"] + present_cols], on="Id", how="left", suffixes=("", "_prev"))
+    prev_lookup = previous[["Id"] + present_cols].drop_duplicates(subset=["Id"], keep="first").set_index("Id")
     rows_enriched = 0
     for c in present_cols:
-        prev_c = f"{c}_prev"
-        if prev_c in merged.columns:
-            merged[c] = merged[c].fillna("").astype(str)
-            mask_take_prev = merged[c].str.strip().eq("") | merged[c].str.lower().eq("nan")
-            rows_enriched += int(mask_take_prev.sum())
-            merged.loc[mask_take_prev, c] = merged.loc[mask_take_prev, prev_c]
-            merged.drop(columns=[prev_c], inplace=True)
-    return merged, {"duplicated_ids": 0, "rows_enriched": rows_enriched}
+        if c not in current.columns:
+            current[c] = current["Id"].map(prev_lookup[c])
+            continue
+        current[c] = current[c].fillna("").astype(str)
+        mask_take_prev = _blank_mask(current[c], nan_is_blank=True)
+        rows_enriched += int(mask_take_prev.sum())
+        if mask_take_prev.any():
+            current.loc[mask_take_prev, c] = current.loc[mask_take_prev, "Id"].map(prev_lookup[c])
+    return current, {"duplicated_ids": 0, "rows_enriched": rows_enriched}
 
 def apply_after_leadstatus_rules(current: pd.DataFrame, previous: Optional[pd.DataFrame],
                                  defaults: Dict[str, str], cols: List[str], id_col: str = "Id") -> Tuple[pd.DataFrame, int]:
-    out = current.copy()
+    out = current
     replacements = 0
+    # Text form of each column after defaults are applied, reused for the "still default" check
+    texts: Dict[str, pd.Series] = {}
     for c in cols:
+        dflt = defaults.get(c, "")
         if c not in out.columns:
-            out[c] = defaults.get(c, "")
-        else:
-            mask_blank = out[c].astype(str).str.strip().eq("")
-            dflt = defaults.get(c, "")
-            if dflt != "":
-                out.loc[mask_blank, c] = dflt
+            out[c] = dflt
+            continue
+        text = out[c].astype(str)
+        if dflt != "":
+            mask_blank = text.str.strip().eq("")
+            out.loc[mask_blank, c] = dflt
+            text = text.mask(mask_blank, dflt)
+        texts[c] = text
     if previous is None or previous.empty or id_col not in out.columns:
         return out, replacements
 
-    prev_cols = [id_col] + [c for c in cols if c in previous.columns]
-    prev = previous[prev_cols].drop_duplicates(subset=[id_col], keep="first")
-    merged = out.merge(prev, on=id_col, how="left", suffixes=("", "__prev"))
+    prev_cols = [c for c in cols if c in previous.columns]
+    prev_lookup = previous[[id_col] + prev_cols].drop_duplicates(subset=[id_col], keep="first").set_index(id_col)
 
-    for c in cols:
+    for c in prev_cols:
         dflt = defaults.get(c, "")
-        prev_c = f"{c}__prev"
-        if prev_c not in merged.columns:
-            continue
-        prev_val = merged[prev_c].astype(str)
-        prev_is_blank = prev_val.str.strip().eq("") | prev_val.str.lower().eq("nan")
-        mask_is_default_now = merged[c].astype(str) == dflt
+        prev_val = out[id_col].map(prev_lookup[c]).astype(str)
+        prev_is_blank = _blank_mask(prev_val, nan_is_blank=True)
+        mask_is_default_now = texts[c] == dflt if c in texts else True
         take_prev = (~prev_is_blank) & (prev_val != dflt) & mask_is_default_now
         replacements += int(take_prev.sum())
-        merged.loc[take_prev, c] = merged.loc[take_prev, prev_c]
-        merged.drop(columns=[prev_c], inplace=True)
-    return merged, replacements
+        out.loc[take_prev, c] = prev_val[take_prev]
+    return out, replacements
+
+def compact_low_cardinality_columns(df: pd.DataFrame, max_ratio: float = 0.05) -> pd.DataFrame:
+    n = max(len(df), 1)
+    for col in df.select_dtypes(include="object").columns:
+        if df[col].nunique(dropna=False) / n < max_ratio:
+            df[col] = df[col].astype("category")
+    return df
+
+def _df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+def _df_to_xlsx_bytes(df: pd.DataFrame, sheet_name: str) -> bytes:
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="xlsxwriter",
+                        engine_kwargs={"options": {"strings_to_urls": False}}) as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return buf.getvalue()
+
+# Only successful fetches are cached: errors raise out of the cached function
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_pending_updates() -> List[Dict]:
+    base_fields = ["id", SUPABASE_ID_FIELD, SUPABASE_EMAIL_FIELD] + list(SUPABASE_TO_FILE_COLS.keys())
+    select_q = ",".join(base_fields)
+    url = f"{SUPABASE_URL}/rest/v1/{UPDATES_TABLE}"
+    params = {"select": select_q, "added_to_file_date": "is.null"}
+
+    slog(f"GET pending updates → {url} (select={select_q})")
+
+    resp = HTTP_SESSION.get(url, headers=HEADERS, params=params, timeout=45)  # Aumentar timeout
+
+    if not resp.ok:
+        slog(f"Supabase GET error {resp.status_code}: {resp.text[:500]}", "error")
+        raise RuntimeError(f"Supabase GET error {resp.status_code}")
+
+    data = json_loads(resp.content)
+    slog(f"Pending updates fetched: {len(data)}")
+    return data
 
 def _fetch_pending_updates_from_supabase() -> Tuple[List[Dict], Optional[str]]:
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        return [], "Missing SUPABASE_URL/SUPABASE_KEY"
     try:
-        if not SUPABASE_URL or not SUPABASE_KEY:
-            return [], "Missing SUPABASE_URL/SUPABASE_KEY"
-        
-        base_fields = ["id", SUPABASE_ID_FIELD, SUPABASE_EMAIL_FIELD] + list(SUPABASE_TO_FILE_COLS.keys())
-        select_q = ",".join(base_fields)
-        url = f"{SUPABASE_URL}/rest/v1/{UPDATES_TABLE}"
-        params = {"select": select_q, "added_to_file_date": "is.null"}
-        
-        slog(f"GET pending updates → {url} (select={select_q})")
-        
-        # Usar sesión con retries
-        session = create_session_with_retries()
-        resp = session.get(url, headers=HEADERS, params=params, timeout=45)  # Aumentar timeout
-        
-        if not resp.ok:
-            slog(f"Supabase GET error {resp.status_code}: {resp.text[:500]}", "error")
-            return [], f"Supabase GET error {resp.status_code}"
-        
-        data = resp.json()
-        slog(f"Pending updates fetched: {len(data)}")
-        return data, None
-        
+        return _cached_pending_updates(), None
+    except RuntimeError as e:
+        return [], str(e)
     except requests.exceptions.Timeout:
         slog("Supabase GET timeout after 45s", "error")
         return [], "Supabase GET timeout"
@@ -561,8 +578,33 @@ def _fetch_pending_updates_from_supabase() -> Tuple[List[Dict], Optional[str]]:
         slog(f"Supabase GET exception: {e}", "error")
         return [], f"Supabase GET exception: {str(e)}"
 
+def _set_cells(df: pd.DataFrame, col: str, positions, values) -> None:
+    # One positional setter per column; object dtype so string values never upcast cell by cell
+    if df[col].dtype != object:
+        df[col] = df[col].astype(object)
+    df.iloc[positions, df.columns.get_loc(col)] = values
+
+def _lead_match_key(val) -> Optional[str]:
+    if val is None or (pd.api.types.is_scalar(val) and pd.isna(val)):
+        return None
+    s = str(val).strip()
+    if s == "" or s.lower() == "nan":
+        return None
+    try:
+        return f"I:{int(s.replace(',', ''))}"
+    except ValueError:
+        return f"S:{s.lower()}"
+
+def _email_match_key(val) -> Optional[str]:
+    if val is None or (pd.api.types.is_scalar(val) and pd.isna(val)):
+        return None
+    em = str(val).strip().lower()
+    if em == "" or em == "nan":
+        return None
+    return f"E:{em}"
+
 def apply_supabase_pending_updates(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int], List[str]]:
-    out = df.copy()
+    out = df
     updates, err = _fetch_pending_updates_from_supabase()
     stats = {"pending": 0, "matched_rows": 0, "cells_written": 0, "unmatched": 0}
     processed_update_ids: List[str] = []
@@ -575,80 +617,47 @@ def apply_supabase_pending_updates(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict
     if stats["pending"] == 0:
         return out, stats, processed_update_ids
 
-    has_id_col = "Id" in out.columns
-    has_email_col = "Email" in out.columns
-
-    id_int_pos_map: Dict[int, int] = {}
-    id_str_pos_map: Dict[str, int] = {}
-    email_pos_map: Dict[str, int] = {}
-
-    norm_str = lambda v: str(v).strip()
-    norm_low = lambda v: str(v).strip().lower()
-
-    if has_id_col:
-        sub = out[out["Id"].notna()].reset_index()
-        for _, row in sub.iterrows():
-            pos = int(row["index"])
-            raw_id = row["Id"]
-            s = norm_str(raw_id)
-            if s == "" or s.lower() == "nan":
-                continue
-            try:
-                id_int = int(s.replace(",", ""))
-                id_int_pos_map[id_int] = pos
-            except ValueError:
-                id_str_pos_map[norm_low(s)] = pos
-
-    if has_email_col:
-        sub = out[out["Email"].notna()].reset_index()
-        for _, row in sub.iterrows():
-            pos = int(row["index"])
-            em = norm_low(row["Email"])
-            if em and em != "nan":
-                email_pos_map[em] = pos
+    # One key space for every row: "I:<int id>", "S:<text id>", "E:<email>" -> row position
+    key_to_pos: Dict[str, int] = {}
+    if "Id" in out.columns:
+        key_to_pos.update((k, p) for p, k in enumerate(out["Id"].map(_lead_match_key)) if k)
+    if "Email" in out.columns:
+        key_to_pos.update((k, p) for p, k in enumerate(out["Email"].map(_email_match_key)) if k)
+
+    leads = pd.Series([upd.get(SUPABASE_ID_FIELD) for upd in updates], dtype=object)
+    emails = pd.Series([upd.get(SUPABASE_EMAIL_FIELD) for upd in updates], dtype=object)
+    positions = (
+        leads.map(_lead_match_key).map(key_to_pos)
+        .fillna(emails.map(_email_match_key).map(key_to_pos))
+    )
 
     DATE_KEYS = {"asked_contact_for_promos_date", "asked_contact_next_year_date"}
 
-    for upd in updates:
-        pos = None
-        lead_val = upd.get(SUPABASE_ID_FIELD, None)
-        if lead_val is not None:
-            s = norm_str(lead_val)
-            if s:
-                try:
-                    lead_int = int(s.replace(",", ""))
-                    if has_id_col and lead_int in id_int_pos_map:
-                        pos = id_int_pos_map[lead_int]
-                except ValueError:
-                    key = norm_low(s)
-                    if has_id_col and key in id_str_pos_map:
-                        pos = id_str_pos_map[key]
-        if pos is None:
-            email_val = norm_low(upd.get(SUPABASE_EMAIL_FIELD, "") or "")
-            if email_val and has_email_col and email_val in email_pos_map:
-                pos = email_pos_map[email_val]
-
-        if pos is None:
+    # file column -> {row position: value}; later updates for the same row win
+    writes: Dict[str, Dict[int, object]] = {file_col: {} for file_col in SUPABASE_TO_FILE_COLS.values()}
+
+    for upd, pos in zip(updates, positions):
+        if pd.isna(pos):
             stats["unmatched"] += 1
             continue
+        pos = int(pos)
 
         stats["matched_rows"] += 1
 
         for sb_key, file_col in SUPABASE_TO_FILE_COLS.items():
-            if sb_key not in upd:
-                continue
             val = upd.get(sb_key, None)
             if val is None:
                 continue
-            if sb_key in DATE_KEYS:
-                out.iat[pos, out.columns.get_loc(file_col)] = _fmt_mmddyyyy(val)
-            else:
-                out.iat[pos, out.columns.get_loc(file_col)] = val
+            writes[file_col][pos] = _fmt_mmddyyyy(val) if sb_key in DATE_KEYS else val
             stats["cells_written"] += 1
 
         if "id" in upd and upd["id"] is not None:
             processed_update_ids.append(str(upd["id"]))
 
+    for file_col, cells in writes.items():
+        if cells:
+            _set_cells(out, file_col, list(cells), list(cells.values()))
+
     slog(f"apply_supabase_pending_updates: {stats}")
     return out, stats, processed_update_ids
 
@@ -663,6 +672,20 @@ def _join_ids_for_in(ids: List[str]) -> str:
             out_items.append(f'"{s_escaped}"')
     return ",".join(out_items)
 
+def _patch_updates_added(chunk: List[str], body: Dict[str, str]) -> Tuple[int, Optional[str]]:
+    url = f"{SUPABASE_URL}/rest/v1/{UPDATES_TABLE}?id=in.({_join_ids_for_in(chunk)})"
+    slog(f"PATCH mark added → {len(chunk)} ids")
+    try:
+        resp = HTTP_SESSION.patch(url, headers=HEADERS, data=json_dumps(body), timeout=30)
+        if not resp.ok:
+            return 0, f"Supabase PATCH error {resp.status_code}: {resp.text}"
+        try:
+            return len(json_loads(resp.content)), None
+        except Exception:
+            return len(chunk), None
+    except Exception as e:
+        return 0, f"Supabase PATCH exception: {e}"
+
 def mark_lead_updates_as_added(update_ids: List[str]) -> Tuple[int, Optional[str]]:
     if not update_ids:
         slog("mark_lead_updates_as_added: no ids to update")
@@ -670,30 +693,19 @@ def mark_lead_updates_as_added(update_ids: List[str]) -> Tuple[int, Optional[str
     if not SUPABASE_URL or not SUPABASE_KEY:
         return 0, "Missing SUPABASE_URL/SUPABASE_KEY"
 
-    date_str = _today_date_str()
-    updated_total = 0
+    body = {"added_to_file_date": _today_date_str(), "added_to_file": "Yes"}
     chunk_size = 300
+    chunks = [update_ids[i:i + chunk_size] for i in range(0, len(update_ids), chunk_size)]
 
-    for i in range(0, len(update_ids), chunk_size):
-        chunk = update_ids[i:i + chunk_size]
-        ids_csv = _join_ids_for_in(chunk)
-        url = f"{SUPABASE_URL}/rest/v1/{UPDATES_TABLE}?id=in.({ids_csv})"
-        body = {"added_to_file_date": date_str, "added_to_file": "Yes"}
-        slog(f"PATCH mark added → {len(chunk)} ids")
+    # Chunks are independent; send them concurrently over the pooled session
+    with ThreadPoolExecutor(max_workers=min(4, len(chunks))) as pool:
+        results = list(pool.map(lambda chunk: _patch_updates_added(chunk, body), chunks))
+    _cached_pending_updates.clear()
 
-        try:
-            # Usar sesión con retries
-            session = create_session_with_retries()
-            resp = session.patch(url, headers=HEADERS, data=json.dumps(body), timeout=30)
-            if not resp.ok:
-                return updated_total, f"Supabase PATCH error {resp.status_code}: {resp.text}"
-            try:
-                data = resp.json()
-                updated_total += len(data)
-            except Exception:
-                updated_total += len(chunk)
-        except Exception as e:
-            return updated_total, f"Supabase PATCH exception: {e}"
+    updated_total = sum(count for count, _ in results)
+    errors = [err for _, err in results if err]
+    if errors:
+        return updated_total, errors[0]
 
     slog(f"mark_lead_updates_as_added: updated_total={updated_total}")
     return updated_total, None
@@ -712,8 +724,7 @@ def _download_latest_google_earth_bytes() -> Tuple[Optional[bytes], Optional[str
     slog(f"Download GE latest from storage: {GE_BUCKET}/{GE_LATEST_KEY}")
     
     try:
-        session = create_session_with_retries()
-        resp = session.get(url, headers=_headers_for_storage(), timeout=120)  # Timeout más largo para archivos grandes
+        resp = HTTP_SESSION.get(url, headers=_headers_for_storage(), timeout=120)  # Timeout más largo para archivos grandes
         
         if resp.status_code == 404:
             slog("GE latest not found (404).")
@@ -734,19 +745,21 @@ def _download_latest_google_earth_bytes() -> Tuple[Optional[bytes], Optional[str
 
 # Google Earth
 
-def _load_google_earth_latest_df() -> Tuple[Optional[pd.DataFrame], Dict[str, str], Optional[str]]:
+# Failures raise so st.cache_data only keeps successful loads
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_google_earth_latest() -> Tuple[Optional[pd.DataFrame], Dict[str, str]]:
     b, err = _download_latest_google_earth_bytes()
     if err:
-        return None, {}, err
+        raise RuntimeError(err)
     if b is None:
-        return None, {}, None
+        return None, {}
 
     try:
         with warnings.catch_warnings():
             warnings.simplefilter("ignore", UserWarning)
-            xl = pd.ExcelFile(io.BytesIO(b))
+            xl = pd.ExcelFile(io.BytesIO(b), engine=EXCEL_ENGINE)
     except Exception as e:
-        return None, {}, f"Failed opening latest.xlsx: {e}"
+        raise RuntimeError(f"Failed opening latest.xlsx: {e}")
 
     REQ_CANON = [
         "Id",
@@ -761,13 +774,17 @@ def _load_google_earth_latest_df() -> Tuple[Optional[pd.DataFrame], Dict[str, st
 
     for sheet in xl.sheet_names:
         try:
+            # Match on the header row only; parse the full sheet once it qualifies
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore", UserWarning)
-                tmp = xl.parse(sheet)
-            cols_raw = [str(c).replace("\u00A0", " ").strip() for c in tmp.columns]
+                header = xl.parse(sheet, nrows=0)
+            cols_raw = [str(c).replace("\u00A0", " ").strip() for c in header.columns]
             cols_lower = [c.lower() for c in cols_raw]
             if not all(req in cols_lower for req in REQ_LOWER):
                 continue
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                tmp = xl.parse(sheet)
             rename_map = {}
             for canon, req_low in zip(REQ_CANON, REQ_LOWER):
                 for original, lower in zip(cols_raw, cols_lower):
@@ -783,7 +800,7 @@ def _load_google_earth_latest_df() -> Tuple[Optional[pd.DataFrame], Dict[str, st
             continue
 
     if chosen_df is None:
-        return None, {}, f"latest.xlsx missing required columns: {REQ_CANON}"
+        raise RuntimeError(f"latest.xlsx missing required columns: {REQ_CANON}")
 
     raw_rows = len(chosen_df)
 
@@ -794,9 +811,9 @@ def _load_google_earth_latest_df() -> Tuple[Optional[pd.DataFrame], Dict[str, st
 
     df_out = pd.DataFrame({
         "Id": df_raw["Id"],
-        "Has Fence on Google Earth": df_raw["Has Fence on Google Earth"].apply(_normalize_yes_no_ge),
-        "Google Earth Last Picture At": df_raw["Google Earth Last Picture At"].apply(_parse_to_mmddyyyy_ge),
-        "Google Earth Last Checked At": df_raw["Google Earth Last Checked At"].apply(_parse_to_mmddyyyy_ge),
+        "Has Fence on Google Earth": _normalize_yes_no_ge(df_raw["Has Fence on Google Earth"]),
+        "Google Earth Last Picture At": _parse_to_mmddyyyy_ge(df_raw["Google Earth Last Picture At"]),
+        "Google Earth Last Checked At": _parse_to_mmddyyyy_ge(df_raw["Google Earth Last Checked At"]),
     })
 
     meta = {
@@ -805,6 +822,13 @@ def _load_google_earth_latest_df() -> Tuple[Optional[pd.DataFrame], Dict[str, st
         "rows_after_dedupe": str(len(df_out)),
     }
     slog(f"GE overlay df prepared: rows={len(df_out)} (sheet={meta['sheet']})")
+    return df_out, meta
+
+def _load_google_earth_latest_df() -> Tuple[Optional[pd.DataFrame], Dict[str, str], Optional[str]]:
+    try:
+        df_out, meta = _cached_google_earth_latest()
+    except RuntimeError as e:
+        return None, {}, str(e)
     return df_out, meta, None
 
 def overlay_google_earth_latest(df: pd.DataFrame) -> pd.DataFrame:
@@ -816,41 +840,26 @@ def overlay_google_earth_latest(df: pd.DataFrame) -> pd.DataFrame:
         slog("overlay_google_earth_latest: nothing to apply.")
         return df
 
-    out = df.copy()
-    out_idx: Dict[str, int] = {}
-    for i, v in enumerate(out["Id"]):
-        key = _norm_id(v)
-        if key:
-            out_idx[key] = i
+    out = df
+    out_idx = {key: i for i, key in enumerate(out["Id"].map(_norm_id)) if key}
 
     for col in ["Has Fence on Google Earth", "Google Earth Last Picture At", "Google Earth Last Checked At"]:
         if col not in out.columns:
             out[col] = ""
 
-    applied = 0
-    for _, row in ge_df.iterrows():
-        rid = _norm_id(row["Id"])
-        if not rid:
-            continue
-        pos = out_idx.get(rid)
-        if pos is None:
-            continue
-
-        hv = str(row["Has Fence on Google Earth"]).strip()
-        if hv in {"Yes", "No"}:
-            if str(out.iat[pos, out.columns.get_loc("Has Fence on Google Earth")]).strip() != hv:
-                out.iat[pos, out.columns.get_loc("Has Fence on Google Earth")] = hv
+    # ge_df Ids are already normalized and unique
+    ge_pos = ge_df["Id"].map(out_idx)
+    matched = ge_df[ge_pos.notna()]
+    positions = ge_pos[ge_pos.notna()].astype(int).to_numpy()
 
-        pic = str(row["Google Earth Last Picture At"]).strip()
-        if pic:
-            if str(out.iat[pos, out.columns.get_loc("Google Earth Last Picture At")]).strip() != pic:
-                out.iat[pos, out.columns.get_loc("Google Earth Last Picture At")] = pic
-
-        chk = str(row["Google Earth Last Checked At"]).strip()
-        if chk:
-            if str(out.iat[pos, out.columns.get_loc("Google Earth Last Checked At")]).strip() != chk:
-                out.iat[pos, out.columns.get_loc("Google Earth Last Checked At")] = chk
-        applied += 1
+    for col in ["Has Fence on Google Earth", "Google Earth Last Picture At", "Google Earth Last Checked At"]:
+        new = matched[col].astype(str).str.strip().to_numpy()
+        valid = np.isin(new, ["Yes", "No"]) if col == "Has Fence on Google Earth" else new != ""
+        current = out[col].iloc[positions].astype(str).str.strip().to_numpy()
+        take = valid & (current != new)
+        if take.any():
+            _set_cells(out, col, positions[take], new[take])
+    applied = len(matched)
 
     slog(f"overlay_google_earth_latest: applied to {applied} rows")
     return out
@@ -858,11 +867,6 @@ def overlay_google_earth_latest(df: pd.DataFrame) -> pd.DataFrame:
 # UI 
 
 def show_hubspot_file_creator():
-    st.set_page_config(
-        page_title="Leads File Cleaner", 
-        layout="wide",
-        page_icon="🧹"
-    )
     st.title("🧹 Leads File Cleaner")
 
     MAX_FILE_SIZE_MB = 5 
@@ -882,6 +886,8 @@ def show_hubspot_file_creator():
             "proc_prev_df": None,
             "proc_sb_stats": None,
             "proc_ids": [],
+            "main_df": None,
+            "prev_df": None,
             "ui_init_done": True,
         })
         slog("UI state initialized")
@@ -937,6 +943,8 @@ def show_hubspot_file_creator():
             "proc_prev_df": None,
             "proc_sb_stats": None,
             "proc_ids": [],
+            "main_df": None,
+            "prev_df": None,
         })
         slog(f"Files changed: main={main_sig} prev={prev_sig}")
 
@@ -958,8 +966,12 @@ def show_hubspot_file_creator():
 
     try:
         with step_log("Load main file"):
-            main_df, _ = safe_dataframe_operation(load_file_optimized, main_file, MAX_FILE_SIZE_MB)
-            main_df = normalize_column_names(main_df)
+            # Parsed once per uploaded file; reruns reuse the frame until the file signature changes
+            main_df = st.session_state.get("main_df")
+            if main_df is None:
+                main_df, _ = safe_dataframe_operation(load_file_optimized, main_file, MAX_FILE_SIZE_MB)
+                main_df = normalize_column_names(main_df)
+                st.session_state["main_df"] = main_df
             slog(f"Main columns: {list(main_df.columns)[:12]} ... total={len(main_df.columns)}")
             slog(f"Main df loaded: shape={main_df.shape}")
             st.success(f"✅ Main file loaded: {main_df.shape[0]} rows, {main_df.shape[1]} columns")
@@ -971,7 +983,10 @@ def show_hubspot_file_creator():
     prev_df = None
     if prev_file:
         with step_log("Load previous file safely"):
-            prev_df = load_previous_file_safe(prev_file, MAX_FILE_SIZE_MB)
+            prev_df = st.session_state.get("prev_df")
+            if prev_df is None:
+                prev_df = load_previous_file_safe(prev_file, MAX_FILE_SIZE_MB)
+                st.session_state["prev_df"] = prev_df
             if prev_df is not None:
                 slog(f"Previous df loaded safely: shape={prev_df.shape}")
                 st.success(f"✅ Previous file loaded: {prev_df.shape[0]} rows")
@@ -1037,7 +1052,12 @@ def show_hubspot_file_creator():
             elif step == 7:
                 with step_log("Step 7: Overlay Google Earth + finalize"):
                     df_work = safe_dataframe_operation(overlay_google_earth_latest, df_work)
-                    df_work = df_work.fillna("")
+                    # Blank out missing text only; numeric NaN already exports as an empty cell
+                    for col in df_work.select_dtypes(include=["object", "string"]).columns:
+                        if df_work[col].hasnans:
+                            df_work[col] = df_work[col].fillna("")
+                    # Kept in session state across reruns: store repeated strings as categories
+                    df_work = compact_low_cardinality_columns(df_work)
                     st.session_state["processed_df_df"] = df_work
                     st.session_state["updates_marked"] = False
                     st.session_state["final_ready"] = False
@@ -1093,15 +1113,12 @@ def show_hubspot_file_creator():
                 try:
                     df_final = st.session_state["processed_df_df"]
                     with step_log("Build final CSV/XLSX"):
-                        csv_bytes = safe_dataframe_operation(lambda: df_final.to_csv(index=False).encode("utf-8"))
-                        xlsx_bytes = io.BytesIO()
-                        with pd.ExcelWriter(xlsx_bytes, engine="openpyxl") as writer:
-                            df_final.to_excel(writer, index=False, sheet_name="Processed")
-                        xlsx_bytes.seek(0)
-                        slog(f"Final buffers: csv={len(csv_bytes)} bytes ; xlsx={len(xlsx_bytes.getvalue())} bytes")
+                        csv_bytes = safe_dataframe_operation(_df_to_csv_bytes, df_final)
+                        xlsx_bytes = _df_to_xlsx_bytes(df_final, "Processed")
+                        slog(f"Final buffers: csv={len(csv_bytes)} bytes ; xlsx={len(xlsx_bytes)} bytes")
 
                     st.session_state["final_csv_bytes"] = csv_bytes
-                    st.session_state["final_xlsx_bytes"] = xlsx_bytes.getvalue()
+                    st.session_state["final_xlsx_bytes"] = xlsx_bytes
                     st.session_state["final_ready"] = True
                     st.success("✅ Final file generated.")
 
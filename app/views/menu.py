@@ -1,13 +1,10 @@
 import os
-from urllib.parse import urljoin
 import streamlit as st
 from dotenv import load_dotenv
 
 load_dotenv()
 
 LOGO = os.getenv("LOGO") or ""
-STREAMLIT_URL = os.getenv("STREAMLIT_URL") or ""
-BACKEND_URL = (os.getenv("BACKEND_URL") or "").rstrip("/")
 
 
 def _safe_stretch_button(label: str, key: str):
@@ -18,49 +15,6 @@ def _safe_stretch_button(label: str, key: str):
         return st.button(label, key=key, use_container_width=True)
 
 
-def _handle_logout(backend_url: str | None):
-
-    for k in list(st.session_state.keys()):
-        del st.session_state[k]
-    try:
-        st.cache_data.clear()
-    except Exception:
-        pass
-    try:
-        st.cache_resource.clear()
-    except Exception:
-        pass
-
-    try:
-        st.query_params.update({})
-    except Exception:
-        pass
-
-    if backend_url:
-        logout_url = urljoin(backend_url.rstrip("/") + "/", "logout")
-
-        if not st.session_state.get("_redirected_after_logout"):
-            st.session_state["_redirected_after_logout"] = True
-            st.markdown(
-                f"""
-                <script>
-                  // Replace current history entry (avoids back button loop)
-                  window.location.replace("{logout_url}");
-                </script>
-                """,
-                unsafe_allow_html=True,
-            )
-
-        st.info("Redirecting… If it does not happen automatically, click below.")
-        st.link_button("Go to Logout", logout_url)
-        st.stop()
-    else:
-        st.success("Logged out locally (no BACKEND_URL is set).")
-        if st.button("Back to Home", key="go_home"):
-            st.rerun()
-        st.stop()
-
-
 def show_sidebar_menu():
     if "active_menu" not in st.session_state:
         st.session_state.active_menu = None
@@ -1,21 +1,35 @@
 import streamlit as st
 import pandas as pd
-import tempfile, io, os
+import io
+import re
 import numpy as np
 import altair as alt
+import xlsxwriter
 from io import BytesIO
 from datetime import date
-from openpyxl.styles import Font, Border, Side, Alignment
-from openpyxl.utils import get_column_letter
 from datetime import datetime
 from app.services.supabase_uploader import (
     insert_restock_qt,
-    get_item_by_name,
+    get_items_by_names,
     fetch_restock_kpi_source
 )
 
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
 STATUS_ORDER = ["Critical", "Reorder now", "Near", "Healthy"]
-URGENCY_PRIORITY = {"Critical": 0, "Reorder now": 1, "Near": 2, "Healthy": 3}
+NON_NUMERIC_RE = re.compile(r"[^\d\.\-]")
+
+# in_memory keeps workbooks off disk (it disables constant_memory, which needs temp files);
+# strings_to_urls=False skips the per-string URL regex and matches the old openpyxl output
+XLSX_OPTIONS = {"in_memory": True, "strings_to_urls": False}
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_restock_source() -> list:
+    return fetch_restock_kpi_source()
 
 def show_restock_form():
     st.subheader("🛠️ Restock Items")
@@ -25,50 +39,32 @@ def generate_restock_file_by_categories_template(items: list) -> bytes:
     rename_map = {"category_name": "Category", "name": "Name", "description": "Description"}
     df = df.rename(columns=rename_map)
 
-    df = df[["Category", "Name", "Description"]]
+    df = df[["Category", "Name", "Description"]].fillna("")
     df["Reorder Qty"] = ""   # celdas vacías para que el usuario diligencie
 
+    # xlsxwriter formats are created once and reused for whole columns,
+    # instead of assigning border/alignment objects cell by cell
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        sheet_name = "ReorderingQuantities"
-        df.to_excel(writer, index=False, sheet_name=sheet_name, startrow=1)
-        sheet = writer.sheets[sheet_name]
-
-        sheet["A1"] = "Reordering Minimun Quantities"
-        sheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=4)
-        sheet["A1"].font = Font(bold=True, size=14)
-        sheet["A1"].alignment = Alignment(horizontal="center", vertical="center")
-
-        sheet.freeze_panes = "A3"
-
-        col_widths = [18, 22, 50, 14]
-        for i, w in enumerate(col_widths, start=1):
-            sheet.column_dimensions[get_column_letter(i)].width = w
-
-        indent_align = Alignment(indent=1, vertical="top", wrap_text=True)
-        right_align  = Alignment(indent=1, vertical="top")
-
-        for cell in sheet[2]:
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(vertical="center")
-
-        thin = Border(left=Side(style="thin"), right=Side(style="thin"),
-                      top=Side(style="thin"), bottom=Side(style="thin"))
-
-        first_row = 2      
-        last_row  = len(df) + 2 
-        first_col, last_col = 1, 4
-
-        for row in sheet.iter_rows(min_row=first_row, max_row=last_row,
-                                   min_col=first_col, max_col=last_col):
-            for j, cell in enumerate(row, start=1):
-                cell.border = thin
-                if j in (1, 2, 3):
-                    cell.alignment = indent_align
-                else:
-                    cell.alignment = right_align
-
-    output.seek(0)
+    workbook = xlsxwriter.Workbook(output, XLSX_OPTIONS)
+    sheet = workbook.add_worksheet("ReorderingQuantities")
+
+    title_fmt  = workbook.add_format({"bold": True, "font_size": 14, "align": "center", "valign": "vcenter"})
+    header_fmt = workbook.add_format({"bold": True, "border": 1, "indent": 1, "valign": "top", "text_wrap": True})
+    text_fmt   = workbook.add_format({"border": 1, "indent": 1, "valign": "top", "text_wrap": True})
+    qty_fmt    = workbook.add_format({"border": 1, "indent": 1, "valign": "top"})
+
+    sheet.merge_range(0, 0, 0, 3, "Reordering Minimun Quantities", title_fmt)
+    sheet.freeze_panes(2, 0)
+
+    col_widths = [18, 22, 50, 14]
+    for i, w in enumerate(col_widths):
+        sheet.set_column(i, i, w)
+
+    sheet.write_row(1, 0, df.columns.tolist(), header_fmt)
+    for i, col in enumerate(df.columns):
+        sheet.write_column(2, i, df[col].tolist(), text_fmt if i < 3 else qty_fmt)
+
+    workbook.close()
     return output.getvalue()
 
 def show_upload_restock_file(user: int):    
@@ -82,13 +78,11 @@ def show_upload_restock_file(user: int):
     if not uploaded_file:
         return
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        tmp.write(uploaded_file.read())
-        temp_path = tmp.name
-
     try:
-        df = pd.read_excel(temp_path, header=None)
-        st.dataframe(df.head(6).astype("string"))
+        df = pd.read_excel(BytesIO(uploaded_file.getvalue()), header=None, engine=EXCEL_ENGINE)
+        show_preview = st.checkbox("Show preview", value=False, key="restock_preview")
+        if show_preview:
+            st.dataframe(df.head(6).astype("string"))
 
         raw_headers = df.iloc[1].tolist()
         headers = [str(h).strip().lower() for h in raw_headers]
@@ -98,22 +92,35 @@ def show_upload_restock_file(user: int):
             st.error(f"❌ Header mismatch.\nExpected: {expected_headers}\nFound: {headers}")
             return
 
-        df_data = df.iloc[2:].copy()
-        df_data.columns = expected_headers
+        # Only name and reorder qty are used downstream
+        df_data = df.iloc[2:, [1, 3]].copy()
+        df_data.columns = ["name", "reorder qty"]
 
-        df_data = df_data.astype("string")
         for c in df_data.columns:
             df_data[c] = (df_data[c]
+                          .astype("string")
                           .str.replace("\u00a0", " ", regex=False)
                           .str.strip())
 
         df_data = df_data.dropna(subset=["name"])
-        df_data["reorder qty"] = (df_data["reorder qty"]
-                                  .str.replace(r"[^\d\.\-]", "", regex=True)
-                                  .replace({"": None, "nan": None}))
-        df_data["reorder qty"] = pd.to_numeric(df_data["reorder qty"], errors="coerce").fillna(0)
-
-        st.dataframe(df_data.head().astype("string"))
+        raw_qty = df_data["reorder qty"]
+        parsed = pd.to_numeric(raw_qty, errors="coerce").astype(float)
+        # Exponents and inf/nan go through the strip as before ("1e3" -> 13, "inf" -> 0)
+        dirty = raw_qty.notna() & (~np.isfinite(parsed) | raw_qty.str.contains("e", case=False, regex=False))
+        if dirty.any():
+            parsed[dirty] = pd.to_numeric(
+                raw_qty[dirty].str.replace(NON_NUMERIC_RE, "", regex=True), errors="coerce"
+            ).astype(float)
+        df_data["reorder qty"] = parsed.fillna(0)
+
+        if show_preview:
+            st.dataframe(df_data.head().astype("string"))
+
+        # Toggling the preview reruns the script; don't insert the same file twice
+        upload_key = getattr(uploaded_file, "file_id", None) or uploaded_file.name
+        if st.session_state.get("restock_uploaded_file") == upload_key:
+            st.info("ℹ️ This file was already uploaded.")
+            return
 
         restock_items = []
         total_steps = len(df_data) + 2
@@ -121,21 +128,27 @@ def show_upload_restock_file(user: int):
         status = st.empty()
         step = 0
 
-        for i, (_, row) in enumerate(df_data.iterrows(), 1):
-            status.info(f"🔍 Matching item {i} of {len(df_data)}: {row['name']}")
-            item = get_item_by_name(row["name"])
+        status.info(f"🔍 Matching {len(df_data)} items...")
+        lookup = get_items_by_names(df_data["name"].unique().tolist())
+
+        update_every = max(1, len(df_data) // 100)
+        names = df_data["name"].to_numpy()
+        qtys = df_data["reorder qty"].to_numpy(dtype=float)
+        for i, (name, qty) in enumerate(zip(names, qtys), 1):
+            item = lookup.get(str(name))
             if not item:
-                st.warning(f"⚠️ Item not found: {row['name']}")
+                st.warning(f"⚠️ Item not found: {name}")
                 continue
 
             restock_items.append({
                 "id_item": item["id"],
                 "id_user": user,
                 "date": today,
-                "restock_qty": float(row["reorder qty"]),
+                "restock_qty": float(qty)
             })
             step += 1
-            progress.progress(step / total_steps)
+            if i % update_every == 0:
+                progress.progress(step / total_steps)
 
         status.info(f"📤 Uploading {len(restock_items)} items to Supabase...")
         items_ok = insert_restock_qt(restock_items)
@@ -143,6 +156,8 @@ def show_upload_restock_file(user: int):
         progress.progress(step / total_steps)
 
         if items_ok:
+            _cached_restock_source.clear()
+            st.session_state["restock_uploaded_file"] = upload_key
             status.success("✅ Restock quantities successfully uploaded.")
         else:
             status.error("❌ Failed to upload Restock quantities for items.")
@@ -150,20 +165,14 @@ def show_upload_restock_file(user: int):
 
     except Exception as e:
         st.error(f"❌ Error processing file: {str(e)}")
-    finally:
-        os.unlink(temp_path)
-
-def classify_status(avail: float, minq: float) -> str:
-    if pd.isna(minq) or minq <= 0:
-        return "Healthy"
-    if avail < minq:
-        return "Critical"
-    if avail == minq:
-        return "Reorder now"
+
+def classify_status(avail: pd.Series, minq: pd.Series) -> np.ndarray:
+    avail = np.asarray(avail, dtype=float)
+    minq = np.asarray(minq, dtype=float)
     near = minq * 1.20
-    if avail <= near:
-        return "Near"
-    return "Healthy"
+    conds = [np.isnan(minq) | (minq <= 0), avail < minq, avail == minq, avail <= near]
+    choices = ["Healthy", "Critical", "Reorder now", "Near"]
+    return np.select(conds, choices, default="Healthy")
 
 def build_kpis(rows: list[dict]) -> tuple[pd.DataFrame, dict]:
     df = pd.DataFrame(rows)
@@ -173,23 +182,20 @@ def build_kpis(rows: list[dict]) -> tuple[pd.DataFrame, dict]:
     for c in ["available", "on_so", "on_po", "restock_qty"]:
         df[c] = pd.to_numeric(df.get(c), errors="coerce").fillna(0)
 
-    df["status"] = [
-        classify_status(avail, minq)
-        for avail, minq in zip(df["available"], df["restock_qty"])
-    ]
+    df["status"] = pd.Categorical(
+        classify_status(df["available"], df["restock_qty"]),
+        categories=STATUS_ORDER, ordered=True
+    )
 
-    kpis = df["status"].value_counts().reindex(
-        ["Critical", "Reorder now", "Near", "Healthy"], fill_value=0
-    ).to_dict()
+    kpis = df["status"].value_counts().reindex(STATUS_ORDER, fill_value=0).to_dict()
 
     return df, kpis
 
 def show_kpis():
     st.subheader("📊 Items Stock KPI's")
 
-    data = fetch_restock_kpi_source()
+    data = _cached_restock_source()
     df, kpis = build_kpis(data)
-    df["status"] = pd.Categorical(df["status"], categories=STATUS_ORDER, ordered=True)
 
     crit    = int(kpis.get("Critical", 0))
     reorder = int(kpis.get("Reorder now", 0))
@@ -230,7 +236,7 @@ def show_kpis():
 def show_restock_table_and_file_download():
 
     st.subheader("📝 Create Restock Items List")
-    rows = fetch_restock_kpi_source()
+    rows = _cached_restock_source()
     if not rows:
         st.info("No data to show.")
         return
@@ -239,27 +245,19 @@ def show_restock_table_and_file_download():
     for c in ["available", "on_so", "on_po", "restock_qty"]:
         df[c] = pd.to_numeric(df.get(c, 0), errors="coerce").fillna(0)
 
-    def classify(avail, minq):
-        if pd.isna(minq) or minq <= 0:
-            return "Healthy"
-        if avail < minq:
-            return "Critical"
-        if avail == minq:
-            return "Reorder now"
-        if avail <= minq * 1.20:
-            return "Near"
-        return "Healthy"
-
-    STATUS_ORDER = ["Critical", "Reorder now", "Near", "Healthy"]
-    URGENCY_PRIORITY = {"Critical": 0, "Reorder now": 1, "Near": 2, "Healthy": 3}
-
-    df["status"] = [classify(a, m) for a, m in zip(df["available"], df["restock_qty"])]
-    df["status"] = pd.Categorical(df["status"], categories=STATUS_ORDER, ordered=True)
+    df["status"] = pd.Categorical(
+        classify_status(df["available"], df["restock_qty"]),
+        categories=STATUS_ORDER, ordered=True
+    )
     df["difference"] = (df["restock_qty"] - df["available"]).astype(float)
-    df["urgency"]    = df["status"].map(URGENCY_PRIORITY)
+    # STATUS_ORDER is already most-urgent first, so the category codes are the urgency
+    df["urgency"]    = df["status"].cat.codes.astype("int8")
 
     df = df.sort_values(["urgency", "difference", "on_so"], ascending=[True, False, False])
 
+    EMOJI = {"Critical": "🚨", "Reorder now": "🔴", "Near": "🟠", "Healthy": "🟢"}
+    status_labels = df["status"].cat.rename_categories([f"{EMOJI[s]} {s}" for s in STATUS_ORDER])
+
     view = pd.DataFrame({
         "item_id":     df["item_id"] if "item_id" in df.columns else df["name"],
         "code":        df["name"] if "name" in df.columns else "",
@@ -269,17 +267,15 @@ def show_restock_table_and_file_download():
         "available":   df["available"],
         "reorder_min": df["restock_qty"],
         "difference":  df["difference"],
-        "status":      df["status"].astype(str),
+        "status":      status_labels.astype(str),
     })
 
-    default_selected = view["status"].isin(["Critical", "Reorder now"])
-
-    EMOJI = {"Critical": "🚨", "Reorder now": "🔴", "Near": "🟠", "Healthy": "🟢"}
-    view["status"] = view["status"].map(lambda s: f"{EMOJI.get(s, s)} {s}")
+    # Critical and Reorder now are the first two categories
+    default_selected = df["urgency"].to_numpy() < 2
 
     index_col = "item_id" if "item_id" in view.columns else "code"
     view = view.set_index(index_col)
-    view.insert(0, "select", default_selected.values)
+    view.insert(0, "select", default_selected)
 
     cols_view = ["select", "code", "item", "category", "available", "reorder_min", "difference", "status"]
     edited = st.data_editor(
@@ -313,50 +309,38 @@ def show_restock_table_and_file_download():
         "difference":  "Difference (Reorder - Available)"
     })
 
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        sheet_name = "RestockItems"
-
-        HEADER_ROW = 3
-        DATA_START_ROW = HEADER_ROW + 1
-        STARTROW_TO_EXCEL = HEADER_ROW - 1
-
-        export_df.to_excel(writer, index=False, sheet_name=sheet_name, startrow=STARTROW_TO_EXCEL)
-        ws = writer.sheets[sheet_name]
-
-        last_col = export_df.shape[1]
-        ws["A1"] = "Items to Restock"
-        ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=last_col)
-        from openpyxl.styles import Font, Border, Side, Alignment
-        ws["A1"].font = Font(bold=True, size=14)
-        ws["A1"].alignment = Alignment(horizontal="center", vertical="center")
-
-        ws.freeze_panes = f"A{DATA_START_ROW}"
-
-        for cell in ws[HEADER_ROW]:
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-        thin = Border(left=Side(style="thin"), right=Side(style="thin"),
-                      top=Side(style="thin"), bottom=Side(style="thin"))
-        last_row = HEADER_ROW + len(export_df)
-        for row in ws.iter_rows(min_row=HEADER_ROW, max_row=last_row,
-                                min_col=1, max_col=last_col):
-            for cell in row:
-                cell.border = thin
-
-        from openpyxl.utils import get_column_letter
-        widths = [18, 48, 22, 12, 14, 24]
-        for i, w in enumerate(widths, start=1):
-            ws.column_dimensions[get_column_letter(i)].width = w
-
-        for r in range(DATA_START_ROW, last_row + 1):
-            ws.cell(row=r, column=2).alignment = Alignment(wrap_text=True)
-
-    buf.seek(0)
     st.download_button(
         "📥 Download Restock File",
-        data=buf.getvalue(),
+        data=_restock_items_xlsx_bytes(export_df),
         file_name=f"restock_items_list_{date.today().isoformat()}.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _restock_items_xlsx_bytes(export_df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buf, XLSX_OPTIONS)
+    ws = workbook.add_worksheet("RestockItems")
+
+    HEADER_ROW = 2
+    last_col = export_df.shape[1] - 1
+
+    title_fmt  = workbook.add_format({"bold": True, "font_size": 14, "align": "center", "valign": "vcenter"})
+    header_fmt = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "vcenter"})
+    cell_fmt   = workbook.add_format({"border": 1})
+    wrap_fmt   = workbook.add_format({"border": 1, "text_wrap": True})
+
+    ws.merge_range(0, 0, 0, last_col, "Items to Restock", title_fmt)
+    ws.freeze_panes(HEADER_ROW + 1, 0)
+
+    widths = [18, 48, 22, 12, 14, 24]
+    for i, w in enumerate(widths):
+        ws.set_column(i, i, w)
+
+    ws.write_row(HEADER_ROW, 0, export_df.columns.tolist(), header_fmt)
+    for i, col in enumerate(export_df.columns):
+        values = export_df[col].astype(object).where(export_df[col].notna(), None).tolist()
+        ws.write_column(HEADER_ROW + 1, i, values, wrap_fmt if i == 1 else cell_fmt)
+
+    workbook.close()
+    return buf.getvalue()
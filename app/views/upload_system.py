@@ -1,7 +1,7 @@
 import streamlit as st
-import tempfile, os
+import tempfile, os, shutil
 from app.services.excel_handler import parse_inventory_summary
-from app.services.supabase_uploader import upload_inventory_data
+from app.services.supabase_uploader import upload_inventory_data, chunked
 
 def show_upload_system():
     st.subheader("📅 Upload System Inventory File")
@@ -10,7 +10,7 @@ def show_upload_system():
 
     if uploaded_file:
         with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            tmp.write(uploaded_file.read())
+            shutil.copyfileobj(uploaded_file, tmp, 1 << 20)
             temp_path = tmp.name
 
         try:
@@ -22,10 +22,11 @@ def show_upload_system():
                 
                 bar = st.progress(0)
 
-                for idx, item in enumerate(items, start=1):
-                    
-                    upload_inventory_data([item])
-                    bar.progress(int(idx / total * 100))
+                done = 0
+                for chunk in chunked(items, 1000):
+                    upload_inventory_data(chunk)
+                    done += len(chunk)
+                    bar.progress(int(done / total * 100))
 
                 st.success("✅ Inventory loaded successfully.")
         except Exception as e:
@@ -1,4 +1,5 @@
 import os
+import logging
 import streamlit as st
 from dotenv import load_dotenv
 import requests
@@ -10,39 +11,172 @@ LOGO = os.getenv("LOGO") or ""
 GOOGLE = os.getenv("GOOGLE") or ""
 BACKEND_URL = os.getenv("BACKEND_URL") or ""
 
-from app.views.inventory_dashboard import show_dashboard
-from app.views.dashboard import show_dashboard as show_general_dashboard
-from app.views.upload_system import show_upload_system
-from app.views.upload_physical import (
-    show_upload_physical,
-    generate_physical_inventory_template,
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
 )
+logger = logging.getLogger("inventory_app")
+
 from app.services.supabase_uploader import (
-    get_user_name_by_email,
-    get_user_id_by_email,
+    get_user_by_email,
     fetch_all_categories,
     get_latest_stock_items as fetch_items_by_cat,
 )
-from app.views.restock_manager import (
-    generate_restock_file_by_categories_template,
-    show_upload_restock_file,
-    show_kpis,
-    show_restock_table_and_file_download,
-)
 from app.views.menu import show_sidebar_menu
-from app.views.hubspot_lead_update import (  
-    show_update_lead_form,
-)
-from app.views.hubspot_leads_file import (
-    show_hubspot_file_creator
-)
-from app.views.google_earth_file import (
-    show_google_form
-)
+# Page views are imported inside their menu branch so a rerun only loads the active page
 
 if "user_id" not in st.session_state:
     st.session_state["user_id"] = None
 
+# New tabs and reconnects log in again from ?user=; reuse the lookup instead of hitting Users.
+# Misses raise so st.cache_data doesn't keep them (outage or user added later)
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _cached_user(email: str) -> dict:
+    user = get_user_by_email(email)
+    if user["id"] is None:
+        raise LookupError(email)
+    return user
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_cat_names():
+    cats = fetch_all_categories() or []
+    # Already ordered by name in the query; dict.fromkeys only drops duplicates
+    return list(dict.fromkeys(c["name"].strip() for c in cats if c.get("name")))
+
+# Request errors raise (and are not cached) instead of coming back as an empty list
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_items_by_cat(categories: tuple):
+    return fetch_items_by_cat(categories=list(categories), raise_on_error=True)
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner="Building template...")
+def _build_pc_excel(categories: tuple):
+    items = _cached_items_by_cat(categories)
+    if not items:
+        raise LookupError("no items")
+    from app.views.upload_physical import generate_physical_inventory_template
+    return generate_physical_inventory_template(items, included_categories=list(categories))
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner="Building template...")
+def _build_restock_excel(categories: tuple):
+    items = _cached_items_by_cat(categories)
+    if not items:
+        raise LookupError("no items")
+    from app.views.restock_manager import generate_restock_file_by_categories_template
+    return generate_restock_file_by_categories_template(items)
+
+def _try_build(builder, categories: tuple):
+    try:
+        return builder(categories), None
+    except LookupError:
+        # Empty selections raise so a brief outage doesn't pin "no items" for 10 minutes
+        return None, None
+    except RuntimeError as e:
+        return None, f"Could not load items ({e}). Please try again."
+
+# Reruns only the download panel on its own widget events (no-op before Streamlit 1.33)
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
+@_fragment
+def _pc_download_panel():
+    st.subheader("Download Physical Count Sheet")
+    st.markdown("Select one or more categories to include in the template.")
+
+    cat_names = _cached_cat_names()
+
+    if not cat_names:
+        st.warning("No categories found.")
+    else:
+        selected = st.multiselect(
+            "Categories",
+            options=cat_names,
+            key="pc_categories",
+            placeholder="Choose one or more categories…",
+        )
+
+        build_key = tuple(sorted(selected))
+        if not build_key:
+            st.info("Pick at least one category.")
+            return
+        st.caption(f"{len(build_key)} selected")
+
+        if st.button("Generate File", type="primary", key="gen_file_btn_pc"):
+            excel_bytes, err = _try_build(_build_pc_excel, build_key)
+            if err:
+                st.error(err)
+            elif not excel_bytes:
+                st.warning("No items found for the selected categories.")
+            else:
+                # Only the selection is kept per session; the bytes live in the shared cache
+                st.session_state["pc_build_key"] = build_key
+                st.success("Template generated. Use the button below to download it.")
+
+        excel_bytes = None
+        if "pc_build_key" in st.session_state:
+            excel_bytes, _ = _try_build(_build_pc_excel, st.session_state["pc_build_key"])
+        if excel_bytes:
+            st.download_button(
+                label="⬇️ Download Physical Count Sheet",
+                data=excel_bytes,
+                file_name="PhysicalInventorySheet.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="dl_sheet_btn_pc",
+            )
+
+@_fragment
+def _restock_download_panel():
+    st.subheader("Download Min Reorder File")
+    st.markdown("Select one or more categories to include in the file.")
+
+    cat_names = _cached_cat_names()
+
+    if not cat_names:
+        st.warning("No categories found.")
+    else:
+        selected = st.multiselect(
+            "Categories",
+            options=cat_names,
+            key="pc_categories_restock",
+            placeholder="Choose one or more categories…",
+        )
+
+        build_key = tuple(sorted(selected))
+        if not build_key:
+            st.info("Pick at least one category.")
+            return
+        st.caption(f"{len(build_key)} selected")
+
+        if st.button("Generate File", type="primary", key="gen_file_btn_restock"):
+            excel_bytes, err = _try_build(_build_restock_excel, build_key)
+            if err:
+                st.error(err)
+            elif not excel_bytes:
+                st.warning("No items found for the selected categories.")
+            else:
+                # Only the selection is kept per session; the bytes live in the shared cache
+                st.session_state["restock_build_key"] = build_key
+                st.success("Template generated. Use the button below to download it.")
+
+        excel_bytes = None
+        if "restock_build_key" in st.session_state:
+            excel_bytes, _ = _try_build(_build_restock_excel, st.session_state["restock_build_key"])
+        if excel_bytes:
+            st.download_button(
+                label="⬇️ Download Reordering Quantities Sheet",
+                data=excel_bytes,
+                file_name="ReorderingQuantities.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="dl_sheet_btn_restock",
+            )
+
+def _clear_query_params():
+    # Only rewrite the URL when there is something to drop; each write costs a rerun
+    try:
+        if st.query_params:
+            st.query_params.clear()
+    except AttributeError:  # Streamlit < 1.30 has no st.query_params
+        pass
+
 def logout_user():
 
     try:
@@ -56,20 +190,14 @@ def logout_user():
         
         st.session_state.clear()
         
-        try:
-            st.query_params.clear()
-        except Exception:
-            pass
+        _clear_query_params()
             
         st.success("You have been logged out successfully")
         st.rerun()
         
     except Exception as e:
         st.session_state.clear()
-        try:
-            st.query_params.clear()
-        except Exception:
-            pass
+        _clear_query_params()
         st.rerun()
 
 def require_login():
@@ -77,30 +205,25 @@ def require_login():
 
     if "logout" in query_params:
         st.session_state.clear()
-        try:
-            st.query_params.clear()
-        except Exception:
-            pass
+        _clear_query_params()
         st.rerun()
 
     if "user" not in st.session_state:
-        if "user" in query_params:
-            email = query_params["user"]
-            if isinstance(email, list):
-                email = email[0]
-
+        # st.query_params.get returns the last value as str
+        email = query_params.get("user") or ""
+        if email:
             st.session_state["user"] = email
-            user_name = get_user_name_by_email(email)
-            st.session_state["name"] = user_name or email
+            try:
+                user = _cached_user(email)
+            except LookupError:
+                user = {"id": None, "name": None}
+            st.session_state["name"] = user["name"] or email
 
-            st.session_state["user_id"] = get_user_id_by_email(email)
-            print("User Id en login:", st.session_state["user_id"])
+            st.session_state["user_id"] = user["id"]
+            logger.debug("User id at login: %s", st.session_state["user_id"])
 
             st.success(f"Welcome 👋 {st.session_state['name']}")
-            try:
-                st.query_params.clear()
-            except Exception:
-                pass
+            _clear_query_params()
         else:
             if LOGO:
                 try:
@@ -130,55 +253,25 @@ show_logout_button()
 
 
 if active_menu == "Inventory" and active_submenu == "System Inventory":
+    from app.views.upload_system import show_upload_system
     show_upload_system()
 
 elif active_menu == "Inventory" and active_submenu == "Physical Count":
+    from app.views.upload_physical import show_upload_physical
     col1, col2 = st.columns([0.6, 0.4])
 
     with col1:
         show_upload_physical()
 
     with col2:
-        st.subheader("Download Physical Count Sheet")
-        st.markdown("Select one or more categories to include in the template.")
-
-        cats = fetch_all_categories() or []
-        cat_names = sorted({(c.get("name") or "").strip() for c in cats if c.get("name")})
-
-        if not cat_names:
-            st.warning("No categories found.")
-        else:
-            selected = st.multiselect(
-                "Categories",
-                options=cat_names,
-                key="pc_categories",
-                placeholder="Choose one or more categories…",
-            )
-
-            st.caption(f"{len(selected)} selected")
-
-            if st.button("Generate File", disabled=len(selected) == 0, type="primary", key="gen_file_btn_pc"):
-                items = fetch_items_by_cat(categories=selected)
-                if not items:
-                    st.warning("No items found for the selected categories.")
-                else:
-                    excel_bytes = generate_physical_inventory_template(
-                        items,
-                        included_categories=selected,
-                    )
-                    st.session_state["pc_excel_bytes"] = excel_bytes
-                    st.success("Template generated. Use the button below to download it.")
-
-            if "pc_excel_bytes" in st.session_state:
-                st.download_button(
-                    label="⬇️ Download Physical Count Sheet",
-                    data=st.session_state["pc_excel_bytes"],
-                    file_name="PhysicalInventorySheet.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    key="dl_sheet_btn_pc",
-                )
+        _pc_download_panel()
 
 elif active_menu == "Inventory" and active_submenu == "Restock Manager":
+    from app.views.restock_manager import (
+        show_upload_restock_file,
+        show_kpis,
+        show_restock_table_and_file_download,
+    )
     show_kpis()
     show_restock_table_and_file_download()
 
@@ -186,67 +279,39 @@ elif active_menu == "Inventory" and active_submenu == "Restock Manager":
 
     with col1:
         uid = st.session_state.get("user_id")
-        print("User ID:", uid)
         if not uid:
             st.warning("No user id in session. Please sign in again.")
         else:
             show_upload_restock_file(uid)
 
     with col2:
-        st.subheader("Download Min Reorder File")
-        st.markdown("Select one or more categories to include in the file.")
-
-        cats = fetch_all_categories() or []
-        cat_names = sorted({(c.get("name") or "").strip() for c in cats if c.get("name")})
-
-        if not cat_names:
-            st.warning("No categories found.")
-        else:
-            selected = st.multiselect(
-                "Categories",
-                options=cat_names,
-                key="pc_categories_restock",
-                placeholder="Choose one or more categories…",
-            )
-
-            st.caption(f"{len(selected)} selected")
-
-            if st.button("Generate File", disabled=len(selected) == 0, type="primary", key="gen_file_btn_restock"):
-                items = fetch_items_by_cat(categories=selected)
-                if not items:
-                    st.warning("No items found for the selected categories.")
-                else:
-                    excel_bytes = generate_restock_file_by_categories_template(items)
-                    st.session_state["pc_excel_bytes"] = excel_bytes
-                    st.success("Template generated. Use the button below to download it.")
-
-            if "pc_excel_bytes" in st.session_state:
-                st.download_button(
-                    label="⬇️ Download Reordering Quantities Sheet",
-                    data=st.session_state["pc_excel_bytes"],
-                    file_name="ReorderingQuantities.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    key="dl_sheet_btn_restock",
-                )
+        _restock_download_panel()
 
 elif active_menu == "Dashboard":
+    from app.views.dashboard import show_dashboard as show_general_dashboard
     show_general_dashboard()
 
 elif active_menu == "Inventory":
+    from app.views.inventory_dashboard import show_dashboard
     show_dashboard()
 
 elif active_menu == "HubSpot" and active_submenu == "Create New Leads File":
+    from app.views.hubspot_leads_file import show_hubspot_file_creator
     show_hubspot_file_creator()
 
 elif active_menu == "HubSpot" and active_submenu == "Update Leads":
+    from app.views.hubspot_lead_update import show_update_lead_form
     show_update_lead_form()
 
 elif active_menu == "HubSpot":
+    from app.views.hubspot_lead_update import show_update_lead_form
     show_update_lead_form()
 
 elif active_menu == "Google Earth":
+    from app.views.google_earth_file import show_google_form
     show_google_form()
 
 # Default
 else:
+    from app.views.dashboard import show_dashboard as show_general_dashboard
     show_general_dashboard()
\ No newline at end of file